@@ -1,21 +1,209 @@
 import google.generativeai as genai
+import hashlib
+import json
 import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+# JSON-mode response schemas: Gemini returns validated JSON, so no free-text parsing is needed
+CREDIBILITY_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "label": {"type": "string", "enum": ["Credible", "Not Credible"]},
+        "reasoning": {"type": "string"},
+    },
+    "required": ["label", "reasoning"],
+}
+BATCH_CREDIBILITY_RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "index": {"type": "integer"},
+            "label": {"type": "string", "enum": ["Credible", "Not Credible"]},
+            "reasoning": {"type": "string"},
+        },
+        "required": ["index", "label", "reasoning"],
+    },
+}
+BATCH_GENERATION_CONFIG = {"response_mime_type": "application/json", "response_schema": BATCH_CREDIBILITY_RESPONSE_SCHEMA}
+
+_TRUNCATION_MARKER_RE = re.compile(r"\s*\[\+\d+ chars\]\s*$") # News API's "... [+1234 chars]" suffix on content
+_WHITESPACE_RE = re.compile(r"\s+")
+
+DESCRIPTION_CHAR_BUDGET = 300
+CONTENT_CHAR_BUDGET = 500
+
+
+def _trim(text, max_chars):
+    """
+    Collapses whitespace, drops News API's truncation marker and caps the length,
+    so article snippets cost as few prompt tokens as possible.
+    """
+    text = _TRUNCATION_MARKER_RE.sub("", text)
+    return _WHITESPACE_RE.sub(" ", text).strip()[:max_chars]
+
+
+class GeminiRateLimiter:
+    """
+    Proactive requests-per-minute / tokens-per-minute throttle for Gemini calls.
+    Callers wait for capacity in a sliding 60 s window instead of finding out about
+    the quota from a 429 after the round-trip has already been spent.
+    """
+    # Published gemini-2.0-flash limits per tier; SAFETY_MARGIN keeps us 10% below them.
+    TIER_LIMITS = {
+        "free": {"rpm": 15, "tpm": 1_000_000},
+        "paid": {"rpm": 2_000, "tpm": 4_000_000},
+    }
+    SAFETY_MARGIN = 0.9
+    WINDOW_SECONDS = 60
+
+    def __init__(self, tier="free"):
+        if tier not in self.TIER_LIMITS:
+            raise ValueError(f"Unknown Gemini tier '{tier}'. Expected one of: {', '.join(self.TIER_LIMITS)}")
+        self.tier = tier
+        self.rpm_limit = max(1, int(self.TIER_LIMITS[tier]["rpm"] * self.SAFETY_MARGIN))
+        self.tpm_limit = max(1, int(self.TIER_LIMITS[tier]["tpm"] * self.SAFETY_MARGIN))
+        self._window = deque() # (monotonic timestamp, estimated tokens) for each request in the last minute
+        self._window_tokens = 0
+        self._lock = threading.Lock() # Guards the window across worker threads
+        self.total_requests = 0
+        self.total_wait_seconds = 0.0
+
+    @staticmethod
+    def estimate_tokens(prompt_text):
+        """
+        Rough input-token estimate (~4 characters per token), good enough for budgeting.
+        """
+        return max(1, len(prompt_text) // 4)
+
+    def _evict_expired(self, now):
+        while self._window and now - self._window[0][0] >= self.WINDOW_SECONDS:
+            _, tokens = self._window.popleft()
+            self._window_tokens -= tokens
+
+    def _seconds_until_capacity(self, now, est_tokens):
+        """
+        Returns 0 if a request of est_tokens fits in the current window, otherwise how long
+        to wait until enough of the oldest requests have aged out.
+        """
+        # A single prompt larger than the whole TPM budget only needs an otherwise empty window.
+        est_tokens = min(est_tokens, self.tpm_limit)
+        if len(self._window) < self.rpm_limit and self._window_tokens + est_tokens <= self.tpm_limit:
+            return 0.0
+        tokens_to_free = self._window_tokens + est_tokens - self.tpm_limit
+        requests_to_free = len(self._window) - self.rpm_limit + 1
+        freed_tokens = 0
+        for i, (timestamp, tokens) in enumerate(self._window):
+            freed_tokens += tokens
+            if i + 1 >= requests_to_free and freed_tokens >= tokens_to_free:
+                return max(0.0, timestamp + self.WINDOW_SECONDS - now)
+        return max(0.0, self._window[-1][0] + self.WINDOW_SECONDS - now)
+
+    def _try_reserve(self, est_tokens):
+        """
+        Records the request and returns 0 if it fits in the window right now,
+        otherwise returns how long the caller should wait before trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._evict_expired(now)
+            delay = self._seconds_until_capacity(now, est_tokens)
+            if delay > 0:
+                return delay
+            self._window.append((now, est_tokens))
+            self._window_tokens += est_tokens
+            self.total_requests += 1
+            return 0.0
+
+    @contextmanager
+    def throttle(self, est_tokens):
+        """
+        Waits until the request fits under both limits, then records it in the window.
+        """
+        waited = 0.0
+        while (delay := self._try_reserve(est_tokens)) > 0:
+            sleep_started = time.monotonic()
+            time.sleep(delay)
+            waited += time.monotonic() - sleep_started
+        if waited:
+            with self._lock:
+                self.total_wait_seconds += waited # Time actually slept, not the sum of each retry's estimate
+        yield
+
+    def stats(self):
+        """
+        Snapshot of limiter usage, e.g. for display in the Streamlit sidebar.
+        """
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            return {
+                "tier": self.tier,
+                "rpm_limit": self.rpm_limit,
+                "tpm_limit": self.tpm_limit,
+                "requests_last_minute": len(self._window),
+                "tokens_last_minute": self._window_tokens,
+                "total_requests": self.total_requests,
+                "total_wait_seconds": round(self.total_wait_seconds, 2),
+            }
+
 
 class NewsValidityAgent:
-    def __init__(self, api_key):
+    CACHE_KEY_FIELDS = ("title", "description", "source", "author", "publishedAt", "content")
+
+    def __init__(self, api_key, max_concurrency=8, tier="free", concurrency_threshold=10):
         self.api_key = api_key
+        self.max_concurrency = max_concurrency # Upper bound on simultaneous Gemini requests
+        self.concurrency_threshold = concurrency_threshold # Batches larger than this go out as one request per article
+        self.rate_limiter = GeminiRateLimiter(tier) # Keeps concurrent batches under the tier's RPM/TPM quota
+        self.cache = {} # Content hash -> parsed assessment, so unchanged articles are not re-sent to Gemini
+        self.cache_hits = 0
+        self.cache_misses = 0
         genai.configure(api_key=self.api_key)
+        # One model client for every call; temperature 0 keeps answers deterministic, which the cache relies on
+        self.model = genai.GenerativeModel(
+            'gemini-2.0-flash',
+            generation_config={
+                "temperature": 0,
+                "response_mime_type": "application/json",
+                "response_schema": CREDIBILITY_RESPONSE_SCHEMA,
+            },
+        )
+
+    def article_cache_key(self, article_data):
+        """
+        SHA-256 of the fields that feed the prompt; identical articles map to the same key.
+        """
+        key_fields = {k: article_data.get(k) for k in self.CACHE_KEY_FIELDS}
+        return hashlib.sha256(json.dumps(key_fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def cache_stats(self):
+        """
+        Hit/miss counters for the assessment cache.
+        """
+        return {"hits": self.cache_hits, "misses": self.cache_misses, "size": len(self.cache)}
     
+    def prompt_fields(self, article_data):
+        """
+        Extracts the article fields used in prompts, with "N/A" for missing values and the
+        description/content snippets trimmed to their character budgets.
+        """
+        title = article_data.get("title") or "N/A"
+        source_name = (article_data.get("source") or {}).get("name") or "N/A"
+        author = article_data.get("author") or "N/A"
+        published_at = article_data.get("publishedAt") or "N/A"
+        description = _trim(article_data.get("description") or "", DESCRIPTION_CHAR_BUDGET) or "N/A"
+        content_snippet = _trim(article_data.get("content") or "", CONTENT_CHAR_BUDGET) or "N/A"
+        return title, source_name, author, published_at, description, content_snippet
+
     def create_credibility_prompt(self, article_data): # Renamed method
         """
         Creates a prompt for Gemini to provide a "Credible" or "Not Credible" assessment and reasoning.
         """
-        title = article_data["title"] if article_data["title"] else "N/A"
-        description = article_data["description"] if article_data["description"] else "N/A"
-        content_snippet = article_data["content"] if article_data["content"] else "N/A"
-        source_name = article_data["source"]["name"] if article_data["source"]["name"] else "N/A"
-        author = article_data["author"] if article_data["author"] else "N/A"
-        published_at = article_data["publishedAt"] if article_data["publishedAt"] else "N/A"
+        title, source_name, author, published_at, description, content_snippet = self.prompt_fields(article_data)
 
         prompt = f"""
         You are a Fact-Checking Analyst AI. Your task is to evaluate the provided news article details and determine if its main factual claims are "Credible" or "Not Credible", along with a brief justification.
@@ -39,21 +227,55 @@ class NewsValidityAgent:
             - Are there any obvious contradictions or unsourced significant claims?
 
         **Output Requirement:**
-        Based on your internal analysis of the above, provide your response *strictly* in the following format:
-
-        Estimated Credibility: [Credible/Not Credible]
-        Reasoning: [Your brief explanation, typically 2-4 sentences, justifying the assessment based on your analysis of source, author, and claim nature.]
+        Based on your internal analysis of the above, respond with a JSON object only:
+        {{"label": "Credible" or "Not Credible", "reasoning": "<your brief explanation, typically 2-4 sentences, justifying the assessment based on your analysis of source, author, and claim nature>"}}
 
         Example 1:
-        Estimated Credibility: Credible
-        Reasoning: The article reports on an official announcement from a regulatory body (IFSB), published by a reputable news agency (Reuters). The claims are factual statements about new standards being released.
+        {{"label": "Credible", "reasoning": "The article reports on an official announcement from a regulatory body (IFSB), published by a reputable news agency (Reuters). The claims are factual statements about new standards being released."}}
 
         Example 2:
-        Estimated Credibility: Not Credible
-        Reasoning: The claims are bold market projections from an unknown research firm, distributed via a press release service (GlobeNewswire). The language is highly promotional, and no independent verification is provided by the news outlet.
+        {{"label": "Not Credible", "reasoning": "The claims are bold market projections from an unknown research firm, distributed via a press release service (GlobeNewswire). The language is highly promotional, and no independent verification is provided by the news outlet."}}
+
+        Only use "Credible" or "Not Credible" as the label.
+        """
+        return prompt
+
+    def create_batch_credibility_prompt(self, articles):
+        """
+        Creates a single prompt that asks Gemini to assess every article in the list at once
+        and answer with a JSON array, one entry per article, matched back by index.
+        """
+        article_blocks = []
+        for index, article_data in enumerate(articles):
+            title, source_name, author, published_at, description, content_snippet = self.prompt_fields(article_data)
+            article_blocks.append(f"""
+        Article [{index}]:
+        - Title: "{title}"
+        - Source Name (News Outlet): "{source_name}"
+        - Author/Publisher of Report (cited in article, or journalist): "{author}"
+        - Publication Date of News Item: "{published_at}"
+        - Description Snippet: "{description}"
+        - Content Snippet: "{content_snippet}"
+        """)
 
-        Do not add any other text before "Estimated Credibility:" or after the reasoning.
-        Only use "Credible" or "Not Credible" as the assessment.
+        prompt = f"""
+        You are a Fact-Checking Analyst AI. Your task is to evaluate each of the {len(articles)} news articles below and determine, for each one independently, if its main factual claims are "Credible" or "Not Credible", along with a brief justification.
+        {"".join(article_blocks)}
+        Instructions for your analysis of each article (consider these points before giving the assessment):
+        1.  **Key Claims:** Identify the main factual claims (e.g., market size "$X Trillion by YYYY", "Z% CAGR", specific events, attributions).
+        2.  **News Outlet:** Assess its nature. Is it a primary news source (e.g., Reuters, Associated Press), a press release distributor (e.g., GlobeNewswire, PR Newswire), an aggregator, a blog? This affects how the information should be viewed.
+        3.  **Author/Original Source:** Assess its likely standing. Is it a known market research firm, an established journalist, a company making an announcement, an academic body, an individual, etc.?
+        4.  **Nature of Claims:** Are these established facts, company announcements, or projections/forecasts? Projections inherently carry uncertainty. A claim being a projection doesn't automatically make it "Not Credible" but its basis should be considered.
+        5.  **Red Flags/Context:**
+            - Is the news outlet primarily a distributor of press releases? This means the content is likely paid for by the "author" and not independently vetted by the outlet. This leans towards "Not Credible" for independent factual claims unless the original source is highly reputable.
+            - Is the language overly promotional or biased?
+            - Are there any obvious contradictions or unsourced significant claims?
+
+        **Output Requirement:**
+        Respond with a JSON array only, containing exactly one object per article:
+        [{{"index": <article number>, "label": "Credible" or "Not Credible", "reasoning": "<2-4 sentences justifying the assessment based on source, author, and claim nature>"}}]
+
+        Use the article number shown in brackets as "index". Only use "Credible" or "Not Credible" as the label.
         """
         return prompt
 
@@ -61,71 +283,185 @@ class NewsValidityAgent:
         """
         Sends the prompt to Gemini and gets the response.
         """
-        model = genai.GenerativeModel('gemini-2.0-flash') # Using gemini-pro for potentially better nuanced reasoning
-        try:
-            response = model.generate_content(prompt_text)
-            return response.text
-        except Exception as e:
-            error_message = f"An error occurred while contacting Gemini: {str(e)}"
-            # Basic error handling; you might want to log more details or check specific error types
-            if hasattr(e, 'response') and hasattr(e.response, 'prompt_feedback') and e.response.prompt_feedback.block_reason:
-                error_message += f" | Block Reason: {e.response.prompt_feedback.block_reason}"
-            elif hasattr(e, 'message') and "quota" in e.message.lower():
-                error_message += " | This might be a rate limit or quota issue. Please check your API usage."
-            return error_message
+        with self.rate_limiter.throttle(GeminiRateLimiter.estimate_tokens(prompt_text)):
+            try:
+                response = self.model.generate_content(prompt_text)
+                return response.text
+            except Exception as e:
+                return self.format_gemini_error(e)
+
+    def format_gemini_error(self, e):
+        """
+        Turns an exception raised by the Gemini client into the error string parse_credibility_response recognises.
+        """
+        error_message = f"An error occurred while contacting Gemini: {str(e)}"
+        # Basic error handling; you might want to log more details or check specific error types
+        if hasattr(e, 'response') and hasattr(e.response, 'prompt_feedback') and e.response.prompt_feedback.block_reason:
+            error_message += f" | Block Reason: {e.response.prompt_feedback.block_reason}"
+        elif hasattr(e, 'message') and "quota" in e.message.lower():
+            error_message += " | This might be a rate limit or quota issue. Please check your API usage."
+        return error_message
 
 
     def parse_credibility_response(self, response_text): # Renamed method
         """
-        Parses the "Credible"/"Not Credible" label and reasoning from Gemini's response.
-        Returns a dictionary: {"label": str, "reasoning": str} or defaults if parsing fails.
+        Parses the JSON {"label", "reasoning"} object Gemini returns in JSON mode.
+        Returns a dictionary: {"label": str, "reasoning": str}, with label "Error" for API errors.
         """
-        label = None
-        reasoning = "Could not parse reasoning from Gemini's response." # Default
+        try:
+            parsed = json.loads(response_text)
+        except (json.JSONDecodeError, TypeError):
+            parsed = None
 
-        # Regex to capture "Credible" or "Not Credible"
-        label_match = re.search(r"Estimated Credibility:\s*(Credible|Not Credible)", response_text, re.IGNORECASE)
-        if label_match:
-            label = label_match.group(1).capitalize() # Ensure consistent capitalization
+        if isinstance(parsed, dict) and parsed.get("label") in ("Credible", "Not Credible"):
+            return {"label": parsed["label"], "reasoning": str(parsed.get("reasoning", "")).strip()}
 
-        reasoning_match = re.search(r"Reasoning:\s*(.*)", response_text, re.DOTALL | re.IGNORECASE)
-        if reasoning_match:
-            reasoning = reasoning_match.group(1).strip()
-        
         # Handle specific error messages from Gemini API
-        elif "An error occurred" in response_text or "Content blocked" in response_text or "quota" in response_text.lower():
-            reasoning = response_text 
-            label = "Error" # Special label for errors
+        if "An error occurred" in response_text or "Content blocked" in response_text or "quota" in response_text.lower():
+            return {"label": "Error", "reasoning": response_text} # Special label for errors
+
+        # The response schema should make this unreachable, but never drop a malformed answer silently
+        return {"label": "Parsing Failed", "reasoning": f"Failed to parse the expected format from AI. Raw response: {response_text}"}
+
+
+    def parse_batch_credibility_response(self, response_text, article_count):
+        """
+        Parses the JSON array returned for a batch prompt.
+        Returns a list aligned with the batch: {"label": str, "reasoning": str}, or None for any
+        article Gemini did not answer properly so it can be retried on its own.
+        """
+        parsed_responses = [None] * article_count
+        try:
+            items = json.loads(response_text)
+        except (json.JSONDecodeError, TypeError):
+            return parsed_responses
+        if not isinstance(items, list):
+            return parsed_responses
 
-        elif label is None and not reasoning_match: # If both failed to parse
-            reasoning = f"Failed to parse the expected format from AI. Raw response: {response_text}"
-            label = "Parsing Failed"
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            index = item.get("index")
+            label = str(item.get("label", "")).strip().capitalize() # Ensure consistent capitalization
+            reasoning = item.get("reasoning")
+            if isinstance(index, int) and 0 <= index < article_count and label in ("Credible", "Not credible") and reasoning:
+                parsed_responses[index] = {"label": "Credible" if label == "Credible" else "Not Credible", "reasoning": str(reasoning).strip()}
+        return parsed_responses
 
-        return {"label": label, "reasoning": reasoning}
 
+    def get_batch_credibility_response(self, articles):
+        """
+        Assesses a whole batch of articles with a single Gemini call in JSON mode.
+        """
+        prompt_text = self.create_batch_credibility_prompt(articles)
+        with self.rate_limiter.throttle(GeminiRateLimiter.estimate_tokens(prompt_text)):
+            try:
+                response = self.model.generate_content(
+                    prompt_text, generation_config=BATCH_GENERATION_CONFIG
+                )
+                response_text = response.text
+            except Exception as e:
+                error_response = self.parse_credibility_response(self.format_gemini_error(e))
+                return [error_response] * len(articles)
+        return self.parse_batch_credibility_response(response_text, len(articles))
 
-    def check_news_claim(self, article_news):
+
+    def build_result(self, article_data, parsed_response):
+        """
+        Shapes one parsed assessment into the result dict returned to callers.
+        """
+        return {
+            "original_title_for_matching": article_data.get("title"), # Ensure this is the exact original title
+            "title": article_data.get("title", "N/A"), # Use .get for safety
+            "credibility_label": parsed_response.get("label"), # New field
+            "reasoning": parsed_response.get("reasoning")
+        }
+
+
+    def store_in_cache(self, cache_key, parsed_response):
+        """
+        Caches successful assessments only; errors and parse failures are retried next time.
+        """
+        if parsed_response.get("label") in ("Credible", "Not Credible"):
+            self.cache[cache_key] = parsed_response
+
+
+    def split_cached(self, articles_list):
+        """
+        Looks every article up in the cache.
+        Returns (cache_keys, cached results as (index, result) pairs, indexes still to assess).
+        """
+        cache_keys = [self.article_cache_key(article_data) for article_data in articles_list]
+        cached = []
+        pending = []
+        for i, cache_key in enumerate(cache_keys):
+            cached_response = self.cache.get(cache_key)
+            if cached_response is None:
+                pending.append(i)
+            else:
+                cached.append((i, self.build_result(articles_list[i], cached_response)))
+        self.cache_hits += len(cached)
+        self.cache_misses += len(pending)
+        return cache_keys, cached, pending
+
+
+    def iter_news_claims(self, article_news):
+        """
+        Yields (index, result) for each article as soon as its assessment is available, so callers
+        can show results while the rest are still in flight. Articles already in the cache are
+        answered locally; up to concurrency_threshold of the rest go out in one batch prompt, and
+        larger batches (or articles the batch failed to answer) are sent from a thread pool, one
+        request per article. The blocking Gemini client releases the GIL while it waits on the
+        network, and nothing here is tied to an event loop, so the agent is safe to keep across
+        Streamlit reruns.
+        """
         articles_list = article_news
-        all_results_detailed = []
 
+        cache_keys, cached, pending = self.split_cached(articles_list)
+        for i, result in cached:
+            yield i, result
+
+        remaining = pending
+        # Small batches fit in one prompt: a single round-trip instead of one per article
+        if pending and len(pending) <= self.concurrency_threshold:
+            batch_responses = self.get_batch_credibility_response([articles_list[i] for i in pending])
+            remaining = []
+            for i, parsed_response in zip(pending, batch_responses):
+                if parsed_response is None:
+                    remaining.append(i)
+                    continue
+                self.store_in_cache(cache_keys[i], parsed_response)
+                yield i, self.build_result(articles_list[i], parsed_response)
+
+        # Anything the batch did not answer (or a batch too large for one prompt) is assessed per article
+        if remaining:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(remaining))) as executor:
+                futures = {
+                    executor.submit(self.get_gemini_accuracy_response, self.create_credibility_prompt(articles_list[i])): i
+                    for i in remaining
+                }
+                for future in as_completed(futures):
+                    i = futures[future]
+                    try:
+                        raw_gemini_response = future.result()
+                    except Exception as e:
+                        raw_gemini_response = self.format_gemini_error(e)
+                    parsed_response = self.parse_credibility_response(raw_gemini_response)
+                    self.store_in_cache(cache_keys[i], parsed_response)
+                    yield i, self.build_result(articles_list[i], parsed_response)
+
+
+    def check_news_claim(self, article_news):
+        """
+        Synchronous entry point used by main.py. Runs on the thread-pool path, so the agent can
+        be called any number of times, from any thread, without an event loop.
+        """
+        articles_list = article_news
         if not articles_list:
             print("No articles found in the JSON or JSON was invalid.") # This print is for direct use, not Streamlit
-            return [] 
-        else:
-            # This print is also for direct use, Streamlit will have its own progress indication
-            # print(f"--- Processing {len(articles_list)} Articles ---") 
-            for article_data in articles_list:
-                article_title = article_data.get("title", "N/A") # Use .get for safety
-
-                prompt = self.create_credibility_prompt(article_data) # Use new prompt method
-
-                raw_gemini_response = self.get_gemini_accuracy_response(prompt)
-                parsed_response = self.parse_credibility_response(raw_gemini_response) # Use new parsing method
-                
-                all_results_detailed.append({
-                    "original_title_for_matching": article_data.get("title"), # Ensure this is the exact original title
-                    "title": article_title,
-                    "credibility_label": parsed_response.get("label"), # New field
-                    "reasoning": parsed_response.get("reasoning")
-                })
-            return all_results_detailed
\ No newline at end of file
+            return []
+
+        all_results_detailed = [None] * len(articles_list)
+        for i, result in self.iter_news_claims(articles_list):
+            all_results_detailed[i] = result
+        return all_results_detailed
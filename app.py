@@ -2,7 +2,7 @@
 
 import streamlit as st
 import os
-import json
+import orjson
 from dotenv import load_dotenv
 
 # Import your existing modules
@@ -22,6 +22,7 @@ st.set_page_config(
 # --- API Key Initialization ---
 gemini_api_key = os.getenv("GOOGLE_API_KEY")
 news_api_key_env = os.getenv("NEWS_API_KEY")
+gemini_tier = os.getenv("GEMINI_TIER", "free") # "free" or "paid"; sets the Gemini rate limits
 
 # --- Initialize Session State ---
 if 'articles' not in st.session_state:
@@ -32,6 +33,20 @@ if 'processing_validation' not in st.session_state:
     st.session_state.processing_validation = False
 
 
+def credibility_label_display(label):
+    """Returns the (text, color) used to show a credibility label"""
+    if label == "Credible":
+        return "Credible", "green"
+    elif label == "Not Credible":
+        return "Not Credible", "red"
+    elif label in ["Error", "Parsing Failed"]:
+        return f"Assessment Error ({label})", "orange"
+    elif label is None: # Should ideally be caught by the above or default to "Not Assessed"
+        return "Not Assessed", "grey"
+    else: # Any other unexpected label
+        return label, "blue"
+
+
 # --- App Title & Description ---
 st.title("⚖️ Islamic Finance News Credibility Assessor")
 st.markdown("""
@@ -89,49 +104,73 @@ if st.session_state.articles:
             st.session_state.error_message = ""
             st.session_state.processing_validation = True
             
-            agent = NewsValidityAgent(api_key=gemini_api_key)
+            # The agent is kept across reruns so its assessment cache and rate limiter window persist.
+            # It only uses the blocking Gemini client from a thread pool, so no state is tied to a
+            # previous run's event loop; it is rebuilt if the API key or tier changes.
+            agent_config = (gemini_api_key, gemini_tier)
+            if st.session_state.get('agent_config') != agent_config or 'agent' not in st.session_state:
+                st.session_state.agent = NewsValidityAgent(api_key=gemini_api_key, tier=gemini_tier)
+                st.session_state.agent_config = agent_config
+            agent = st.session_state.agent
             articles_to_validate = st.session_state.articles
-
-            for article in st.session_state.articles:
-                article.pop('credibility_label', None)
-                article.pop('credibility_reasoning', None) # Renamed from validity_reasoning
+            validation_responses = [None] * len(articles_to_validate) # Filled by position as results arrive
 
             status_message_area = st.sidebar.empty()
             progress_bar = st.sidebar.progress(0)
             
             total_articles = len(articles_to_validate)
 
+            # One placeholder per article, filled in as each assessment arrives
+            live_results = st.empty()
+            with live_results.container():
+                st.subheader("Assessing Articles...")
+                result_slots = [st.empty() for _ in articles_to_validate]
+            for i, article in enumerate(articles_to_validate):
+                result_slots[i].markdown(f"⏳ {article.get('title', f'Untitled Article {i+1}')}")
+
+            assessment_failed = False
             try:
                 with st.spinner(f"Assessing credibility for {total_articles} articles..."):
-                    # agent.check_news_claim now returns list of dicts with 'credibility_label' and 'reasoning'
-                    validation_responses = agent.check_news_claim(articles_to_validate)
-
-                    for i, val_info in enumerate(validation_responses):
-                        article_title_to_match = val_info.get("original_title_for_matching", val_info.get("title"))
-                        
-                        matched_article = next(
-                            (art for art in st.session_state.articles if art['title'] == article_title_to_match), None
+                    # Threaded rather than asyncio: the agent outlives this run, and an async Gemini client would
+                    # stay tied to the event loop it was first used on.
+                    for assessed_count, (i, val_info) in enumerate(agent.iter_news_claims(articles_to_validate), start=1):
+                        # Results carry the article's position, so no search by title is needed
+                        validation_responses[i] = val_info
+
+                        label_display, color = credibility_label_display(val_info.get('credibility_label'))
+                        result_slots[i].markdown(
+                            f"{val_info.get('title')} - <font color='{color}'><b>{label_display}</b></font>", unsafe_allow_html=True
                         )
 
-                        if matched_article:
-                            matched_article['credibility_label'] = val_info.get('credibility_label')
-                            matched_article['credibility_reasoning'] = val_info.get('reasoning', 'No reasoning provided.')
-                        else:
-                            st.warning(f"Could not match validation result for title: {article_title_to_match}")
-                        
-                        progress_bar.progress((i + 1) / total_articles)
-                        status_message_area.info(f"Assessed {(i + 1)}/{total_articles} articles...")
+                        progress_bar.progress(assessed_count / total_articles)
+                        status_message_area.info(f"Assessed {assessed_count}/{total_articles} articles...")
+
+                # Build the assessed list locally and store it with a single session state write
+                st.session_state.articles = [
+                    {
+                        **article,
+                        'credibility_label': val_info.get('credibility_label'),
+                        'credibility_reasoning': val_info.get('reasoning', 'No reasoning provided.'),
+                    }
+                    for article, val_info in zip(articles_to_validate, validation_responses)
+                ]
 
                 status_message_area.success("Credibility assessment complete!")
                 st.sidebar.success("All articles processed!")
 
             except Exception as e:
+                assessment_failed = True
                 st.session_state.error_message = f"Error during AI assessment: {str(e)}"
                 st.sidebar.error(f"AI Assessment Error: {str(e)}")
                 status_message_area.error("Assessment failed.")
             finally:
                 st.session_state.processing_validation = False
                 progress_bar.empty() 
+                live_results.empty() # The article list below renders the full results in this same run
+
+            # Results are already in session state and rendered below; only a failure needs a fresh run
+            # (a failed run leaves the previous assessments in place)
+            if assessment_failed:
                 st.rerun()
 
 # Download button
@@ -153,10 +192,10 @@ if st.session_state.articles and any('credibility_label' in art for art in st.se
             }
             articles_for_download.append(download_art)
 
-        articles_json_string = json.dumps(articles_for_download, indent=2, ensure_ascii=False)
+        articles_json_bytes = orjson.dumps(articles_for_download, option=orjson.OPT_INDENT_2) # download_button accepts bytes
         st.sidebar.download_button(
             label="Download Assessed Articles (JSON)",
-            data=articles_json_string,
+            data=articles_json_bytes,
             file_name="assessed_articles.json",
             mime="application/json"
         )
@@ -164,6 +203,19 @@ if st.session_state.articles and any('credibility_label' in art for art in st.se
         st.sidebar.error(f"Error preparing download: {e}")
 
 
+# Gemini usage since the agent was created
+if 'agent' in st.session_state:
+    usage = st.session_state.agent.rate_limiter.stats()
+    cache_stats = st.session_state.agent.cache_stats()
+    st.sidebar.subheader("Gemini Usage")
+    st.sidebar.caption(
+        f"Tier: {usage['tier']} | Limits: {usage['rpm_limit']} req/min, {usage['tpm_limit']:,} tokens/min\n\n"
+        f"Last minute: {usage['requests_last_minute']} requests, ~{usage['tokens_last_minute']:,} tokens\n\n"
+        f"Throttled for {usage['total_wait_seconds']}s across {usage['total_requests']} requests\n\n"
+        f"Cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses ({cache_stats['size']} stored)"
+    )
+
+
 # --- Display Error Messages ---
 if st.session_state.error_message:
     st.error(st.session_state.error_message)
@@ -209,24 +261,7 @@ if st.session_state.articles:
                 label = article['credibility_label']
                 reasoning = article.get('credibility_reasoning', 'Reasoning not available.') 
                 
-                label_display = "N/A"
-                color = "grey"
-
-                if label == "Credible":
-                    label_display = "Credible"
-                    color = "green"
-                elif label == "Not Credible":
-                    label_display = "Not Credible"
-                    color = "red"
-                elif label in ["Error", "Parsing Failed"]:
-                    label_display = f"Assessment Error ({label})"
-                    color = "orange"
-                elif label is None: # Should ideally be caught by the above or default to "Not Assessed"
-                    label_display = "Not Assessed"
-                else: # Any other unexpected label
-                    label_display = label
-                    color = "blue"
-
+                label_display, color = credibility_label_display(label)
 
                 st.markdown(f"**Assessment:** <font color='{color}'><b>{label_display}</b></font>", unsafe_allow_html=True)
                 st.markdown(f"**Reasoning:** {reasoning}")
@@ -1,40 +1,169 @@
+import aiohttp
+import asyncio
+import copy
+import orjson
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
+import time
+from urllib.parse import quote, urlencode
 from NewsValidityAgent import NewsValidityAgent # Ensure this imports the updated agent
 from dotenv import load_dotenv
 load_dotenv()
 
 gemini_api_key = os.getenv("GOOGLE_API_KEY")
+gemini_tier = os.getenv("GEMINI_TIER", "free") # "free" or "paid"; sets the Gemini rate limits
 
 # News API configuration
 news_url = "https://newsapi.org/v2/everything"
 news_api_key = os.getenv("NEWS_API_KEY")
+NEWS_REQUEST_TIMEOUT = (3, 10)  # (connect, read) seconds, so a stalled request cannot hang the app
+NEWS_CACHE_TTL_SECONDS = 60  # The query is fixed, so results rarely change within a minute
+NEWS_MAX_RESULTS = 100  # The free (developer) plan returns an error for anything past the first 100 results
 
-def get_islamic_finance_news():
-    """Fetch news articles related to Islamic finance standards"""
-    params = {
-        "q": (
-            "AAOIFI OR IFSB OR 'Islamic finance' OR 'Shariah compliance' OR "
-            "'Shariah board' OR 'Islamic banking standards' OR 'fatwa finance' OR "
-            "'Islamic financial regulation' OR 'Islamic accounting' OR 'Sukuk' OR "
-            "'Takaful' OR Murabaha OR Musharaka OR Mudaraba"
-        ),
-        "language": "en",
-        "sortBy": "publishedAt",
-        "pageSize": 10,  # Max results per call
-        "apiKey": news_api_key,
-    }
+# (query, pages, page_size) -> (fetched_at, news_data). Module-level, so it also survives Streamlit reruns.
+_news_cache = {}
+# (query, page, page_size) -> {"etag", "last_modified", "news_data"} for revalidating a page with a conditional GET
+_news_validators = {}
 
+# One pooled session keeps the TLS connection to News API alive between fetches and retries transient failures
+_session = requests.Session()
+_session.mount(
+    "https://",
+    HTTPAdapter(max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])),
+)
+
+NEWS_QUERY = (
+    "AAOIFI OR IFSB OR 'Islamic finance' OR 'Shariah compliance' OR "
+    "'Shariah board' OR 'Islamic banking standards' OR 'fatwa finance' OR "
+    "'Islamic financial regulation' OR 'Islamic accounting' OR 'Sukuk' OR "
+    "'Takaful' OR Murabaha OR Musharaka OR Mudaraba"
+)
+
+
+# The fixed part of the query string is URL-encoded once at import instead of on every fetch
+_NEWS_BASE_QUERY = urlencode(
+    {"q": NEWS_QUERY, "language": "en", "sortBy": "publishedAt"},
+    quote_via=quote,
+)
+
+
+def build_news_url(page_size=10, page=1):
+    """Full request URL for one page of Islamic finance news"""
+    # pageSize is the max results per call
+    return f"{news_url}?{_NEWS_BASE_QUERY}&pageSize={page_size}&page={page}&apiKey={quote(news_api_key or '')}"
+
+
+def conditional_headers(validator_key):
+    """If-None-Match / If-Modified-Since headers for a page we already hold, so News API can answer 304"""
+    validators = _news_validators.get(validator_key)
+    if not validators:
+        return {}
+    headers = {}
+    if validators["etag"]:
+        headers["If-None-Match"] = validators["etag"]
+    if validators["last_modified"]:
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+def remember_validators(validator_key, response_headers, news_data):
+    """Keep a page's ETag / Last-Modified along with its body for the next conditional GET"""
+    etag = response_headers.get("ETag")
+    last_modified = response_headers.get("Last-Modified")
+    if (etag or last_modified) and news_data.get("status") == "ok":
+        _news_validators[validator_key] = {
+            "etag": etag,
+            "last_modified": last_modified,
+            "news_data": copy.deepcopy(news_data),
+        }
+
+
+async def fetch_news_page(session, page, page_size):
+    """Fetch a single page of results over a shared aiohttp session"""
+    validator_key = (NEWS_QUERY, page, page_size)
     try:
-        response = requests.get(news_url, params=params)
+        async with session.get(build_news_url(page_size, page), headers=conditional_headers(validator_key)) as response:
+            if response.status == 304:  # Unchanged since our last fetch; reuse the body we kept
+                return copy.deepcopy(_news_validators[validator_key]["news_data"])
+            response.raise_for_status()  # Raises a ClientResponseError for bad responses (4XX or 5XX)
+            news_data = await response.json()
+            remember_validators(validator_key, response.headers, news_data)
+            return news_data
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:  # ValueError: body was not valid JSON
+        print(f"Error fetching news page {page}: {e}")
+        return {"status": "error", "articles": [], "message": str(e)}
+
+
+async def aget_islamic_finance_news(pages=1, page_size=10):
+    """Fetch several pages of news articles concurrently and merge them into one response"""
+    pages = max(1, min(pages, -(-NEWS_MAX_RESULTS // page_size)))  # Pages past the plan cap only return errors
+    connector = aiohttp.TCPConnector(limit=10)  # Pooled connections shared by all page requests
+    timeout = aiohttp.ClientTimeout(total=30)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        page_results = await asyncio.gather(
+            *(fetch_news_page(session, page, page_size) for page in range(1, pages + 1))
+        )
+
+    ok_pages = [result for result in page_results if result.get("status") == "ok"]
+    if not ok_pages:
+        return page_results[0]  # Every page failed; surface the first error
+
+    failed_pages = [page for page, result in enumerate(page_results, start=1) if result.get("status") != "ok"]
+    articles = []
+    seen_urls = set()
+    for result in ok_pages:
+        for article in result.get("articles", []):
+            # Results can shift between pages while they are fetched, so drop repeats
+            if article.get("url") in seen_urls:
+                continue
+            seen_urls.add(article.get("url"))
+            articles.append(article)
+    news_data = {"status": "ok", "totalResults": ok_pages[0].get("totalResults", len(articles)), "articles": articles}
+    if failed_pages:  # Some pages are missing, so callers (and the cache) can tell this is not the full result
+        news_data["partial"] = True
+        news_data["failedPages"] = failed_pages
+    return news_data
+
+
+def fetch_islamic_finance_news(pages=1, page_size=10):
+    """Fetch news articles related to Islamic finance standards straight from News API"""
+    if pages > 1:
+        # Pages are independent requests, so fetch them in parallel
+        return asyncio.run(aget_islamic_finance_news(pages, page_size))
+
+    validator_key = (NEWS_QUERY, 1, page_size)
+    try:
+        response = _session.get(
+            build_news_url(page_size),
+            headers=conditional_headers(validator_key),
+            timeout=NEWS_REQUEST_TIMEOUT,
+        )
+        if response.status_code == 304:  # Unchanged since our last fetch; reuse the body we kept
+            return copy.deepcopy(_news_validators[validator_key]["news_data"])
         response.raise_for_status()  # Raises an HTTPError for bad responses (4XX or 5XX)
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        news_data = response.json()
+        remember_validators(validator_key, response.headers, news_data)
+        return news_data
+    except (requests.exceptions.RequestException, ValueError) as e:  # ValueError: body was not valid JSON
         print(f"Error fetching news: {e}")
         return {"status": "error", "articles": [], "message": str(e)}
 
 
+def get_islamic_finance_news(pages=1, page_size=10):
+    """Fetch news articles related to Islamic finance standards, reusing a result fetched in the last minute"""
+    cache_key = (NEWS_QUERY, pages, page_size)
+    cached = _news_cache.get(cache_key)
+    if cached and time.monotonic() - cached[0] < NEWS_CACHE_TTL_SECONDS:
+        return copy.deepcopy(cached[1])  # Callers annotate the articles in place, so hand out copies
+
+    news_data = fetch_islamic_finance_news(pages, page_size)
+    if news_data.get("status") == "ok" and not news_data.get("partial"):  # Errors and partial results are never cached
+        _news_cache[cache_key] = (time.monotonic(), copy.deepcopy(news_data))
+    return news_data
+
+
 if __name__ == "__main__":
     if not news_api_key:
         print("NEWS_API_KEY not found in .env file. Exiting.")
@@ -49,11 +178,11 @@ if __name__ == "__main__":
             print("No articles fetched or an error occurred during fetching.")
         else:
             print(f"Fetched {len(articles)} articles. Saving initial fetch to articles_fetched.json")
-            with open("articles_fetched.json", "w", encoding="utf-8") as f:
-                json.dump(articles, f, ensure_ascii=False, indent=2)
+            with open("articles_fetched.json", "wb") as f:
+                f.write(orjson.dumps(articles, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
             
             print("Initializing NewsValidityAgent...")
-            agent = NewsValidityAgent(gemini_api_key)
+            agent = NewsValidityAgent(gemini_api_key, tier=gemini_tier)
             
             print("Validating articles...")
             validated_articles_data = agent.check_news_claim(articles) # This now returns list of dicts with 'credibility_label'
@@ -66,25 +195,23 @@ if __name__ == "__main__":
 
             # Merge validation results back into the original articles list
             # This ensures articles.json has all original data + validation
+            # Index validation results by title once instead of scanning them for every article
+            validation_by_title = {}
+            for val_data in validated_articles_data:
+                validation_by_title.setdefault(val_data.get("original_title_for_matching"), val_data)
+
             articles_with_validation = []
             for original_article in articles:
-                # Find the corresponding validation data
-                # Using original_title_for_matching if available, otherwise title
-                match_found = False
-                for val_data in validated_articles_data:
-                    if original_article.get("title") == val_data.get("original_title_for_matching"):
-                        # Create a new dictionary to avoid modifying original_article in place if it's referenced elsewhere
-                        updated_article = original_article.copy()
-                        updated_article['credibility_label'] = val_data.get('credibility_label')
-                        updated_article['credibility_reasoning'] = val_data.get('reasoning') # Using 'credibility_reasoning'
-                        articles_with_validation.append(updated_article)
-                        match_found = True
-                        break
-                if not match_found: # If no match (shouldn't happen if titles are consistent)
-                    articles_with_validation.append(original_article.copy())
+                # Create a new dictionary to avoid modifying original_article in place if it's referenced elsewhere
+                updated_article = original_article.copy()
+                val_data = validation_by_title.get(original_article.get("title"))
+                if val_data: # No match shouldn't happen if titles are consistent
+                    updated_article['credibility_label'] = val_data.get('credibility_label')
+                    updated_article['credibility_reasoning'] = val_data.get('reasoning') # Using 'credibility_reasoning'
+                articles_with_validation.append(updated_article)
 
 
             print(f"Saving articles with credibility assessment to articles.json")
-            with open("articles.json", "w", encoding="utf-8") as f:
-                json.dump(articles_with_validation, f, ensure_ascii=False, indent=2)
+            with open("articles.json", "wb") as f:  # orjson writes UTF-8 bytes and never escapes non-ASCII
+                f.write(orjson.dumps(articles_with_validation, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
             print("Process complete. Check articles.json.")
\ No newline at end of file
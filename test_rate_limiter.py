@@ -0,0 +1,58 @@
+import unittest
+from unittest import mock
+
+from NewsValidityAgent import GeminiRateLimiter
+
+
+class SecondsUntilCapacityTest(unittest.TestCase):
+    def fill_window(self, limiter, entries):
+        for timestamp, tokens in entries:
+            limiter._window.append((timestamp, tokens))
+            limiter._window_tokens += tokens
+
+    def test_rpm_boundary(self):
+        limiter = GeminiRateLimiter("free") # 13 requests per minute after the safety margin
+        self.fill_window(limiter, [(float(t), 1) for t in range(limiter.rpm_limit - 1)])
+        self.assertEqual(limiter._seconds_until_capacity(20.0, 1), 0.0)
+
+        self.fill_window(limiter, [(100.0, 1)])
+        # The window is full, so the next slot opens when the oldest request (t=0) ages out
+        self.assertEqual(limiter._seconds_until_capacity(20.0, 1), 40.0)
+
+    def test_tpm_boundary(self):
+        limiter = GeminiRateLimiter("free")
+        self.fill_window(limiter, [(0.0, limiter.tpm_limit - 100), (10.0, 50)])
+        self.assertEqual(limiter._seconds_until_capacity(30.0, 50), 0.0)
+        # One token over the budget: the t=0 entry must age out first
+        self.assertEqual(limiter._seconds_until_capacity(30.0, 51), 30.0)
+
+    def test_prompt_larger_than_tpm_waits_for_empty_window(self):
+        limiter = GeminiRateLimiter("free")
+        self.assertEqual(limiter._seconds_until_capacity(0.0, limiter.tpm_limit * 2), 0.0)
+        self.fill_window(limiter, [(5.0, 10)])
+        self.assertEqual(limiter._seconds_until_capacity(15.0, limiter.tpm_limit * 2), 50.0)
+
+
+class ThrottleWaitAccountingTest(unittest.TestCase):
+    def test_records_time_slept_not_estimates(self):
+        limiter = GeminiRateLimiter("free")
+        clock = [0.0]
+        sleep_fractions = iter([0.5]) # The first sleep wakes early, forcing a second reservation attempt
+
+        def fake_sleep(seconds):
+            clock[0] += seconds * next(sleep_fractions, 1.0)
+
+        with mock.patch("NewsValidityAgent.time.monotonic", side_effect=lambda: clock[0]), \
+                mock.patch("NewsValidityAgent.time.sleep", side_effect=fake_sleep):
+            for _ in range(limiter.rpm_limit):
+                with limiter.throttle(1):
+                    pass
+            self.assertEqual(limiter.total_wait_seconds, 0.0)
+            with limiter.throttle(1):
+                pass
+        self.assertEqual(limiter.total_wait_seconds, 60.0)
+        self.assertEqual(limiter.total_requests, limiter.rpm_limit + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()